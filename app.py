@@ -1,20 +1,16 @@
-import base64
-import html
+import hashlib
 import io
-import json
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from zoneinfo import ZoneInfo
 from pathlib import Path
-from uuid import uuid4
 
-import gspread
 import streamlit as st
 import streamlit.components.v1 as components
-from google.auth.transport.requests import Request
-from google.oauth2 import service_account
-from google.oauth2.credentials import Credentials
-from googleapiclient.discovery import build
-from googleapiclient.http import MediaIoBaseUpload
 
 from bpmn_to_text import render_bpmn_bytes
 
@@ -29,52 +25,155 @@ PALETTE = {
     "coral": "#FF7043",
 }
 
-LOGO_LOCAL = "assets/logo.png"
-IG_ICON_PATH = "assets/instagram.png"
-LI_ICON_PATH = "assets/linkedin.png"
-LOGO_DATA_URI = ""
+LOGO_URL = "app/static/logo.png"
+IG_ICON = "app/static/instagram.png"
+LI_ICON = "app/static/linkedin.png"
+DRIVE_RESUMABLE_THRESHOLD = 5 * 1024 * 1024
+SHEETS_BATCH_SIZE = 20
+SHEETS_FLUSH_SECONDS = 5.0
 
+logger = logging.getLogger(__name__)
 
-def _img_data_uri(path: str) -> str:
-    p = Path(path)
-    if not p.exists():
-        return ""
-    data = p.read_bytes()
-    encoded = base64.b64encode(data).decode("ascii")
-    return f"data:image/{p.suffix.lstrip('.')};base64,{encoded}"
 
+@st.cache_resource(show_spinner=False)
+def _background_executor() -> ThreadPoolExecutor:
+    """Executor compartilhado para envios ao Drive fora do fluxo da interface."""
+    return ThreadPoolExecutor(max_workers=2, thread_name_prefix="bpmn-sync")
 
-IG_ICON = _img_data_uri(IG_ICON_PATH)
-LI_ICON = _img_data_uri(LI_ICON_PATH)
-LOGO_DATA_URI = _img_data_uri(LOGO_LOCAL)
 
+@st.cache_data(show_spinner=False, max_entries=16)
+def _render_cached(data_hash: bytes, _data: bytes, filename: str) -> str:
+    """Renderiza o BPMN uma vez por conteudo; o hash evita que o Streamlit hasheie os bytes."""
+    return render_bpmn_bytes(_data, filename=filename)
 
-def _append_to_sheet(filename: str, extracted_text: str) -> tuple[bool, str]:
-    """Anexa dados na planilha do Google Sheets (se configurado em st.secrets)."""
-    if "gcp_service_account" not in st.secrets or "sheets" not in st.secrets:
+
+def _display_text(result_text: str) -> str:
+    """Insere uma linha em branco apos o "Titulo:" inicial sem quebrar o texto todo em linhas."""
+    nl = result_text.find("\n")
+    first_line = result_text if nl < 0 else result_text[:nl]
+    if not first_line.strip().lower().startswith("titulo:"):
+        return result_text
+    if nl < 0:
+        return result_text + "\n"
+    return result_text[: nl + 1] + "\n" + result_text[nl + 1 :]
+
+
+@st.cache_resource(show_spinner=False)
+def _seen_hashes() -> tuple[set[tuple[str, str]], threading.Lock]:
+    """Pares (hash, destino) ja enviados ao "drive"/"sheets"; a coluna D do Sheets e carregada em segundo plano."""
+    seen: set[tuple[str, str]] = set()
+    lock = threading.Lock()
+    if _sheets_config_ok():
+        _background_executor().submit(_seed_seen_hashes, seen, lock)
+    return seen, lock
+
+
+def _seed_seen_hashes(seen: set[tuple[str, str]], lock: threading.Lock) -> None:
+    """Le a coluna D do Sheets fora da thread do script; cada hash ali ja passou pelos dois destinos."""
+    try:
+        hashes = [h for h in _get_gspread_worksheet().col_values(4) if h]
+    except Exception as exc:  # pragma: no cover - depende de servico externo
+        logger.warning("Nao foi possivel carregar os hashes ja enviados do Sheets: %s", exc)
+        return
+    with lock:
+        seen.update((h, destination) for h in hashes for destination in ("drive", "sheets"))
+
+
+def _claim_content(content_hash: str, destination: str) -> bool:
+    """Registra (hash, destino) e indica se o conteudo ainda nao tinha sido enviado a esse destino."""
+    seen, lock = _seen_hashes()
+    key = (content_hash, destination)
+    with lock:
+        if key in seen:
+            return False
+        seen.add(key)
+    return True
+
+
+def _release_content(content_hash: str, destination: str) -> None:
+    """Desfaz o registro para que o conteudo possa ser enviado de novo a esse destino."""
+    seen, lock = _seen_hashes()
+    with lock:
+        seen.discard((content_hash, destination))
+
+
+def _upload_new_content(filename: str, content: bytes, content_hash: str) -> tuple[bool, str]:
+    """Envia ao Drive o conteudo recem-registrado; se o envio falhar, libera so o registro do Drive."""
+    ok, err = _upload_to_drive(filename, content)
+    if not ok and _drive_config_ok():
+        _release_content(content_hash, "drive")
+    return ok, err
+
+
+def _append_to_sheet(filename: str, extracted_text: str, content_hash: str) -> tuple[bool, str]:
+    """Enfileira a linha para o Google Sheets (se configurado em st.secrets); o envio e feito em lote."""
+    if not _sheets_config_ok():
         return False, "Configuracao do Sheets ausente."
+    stamp = datetime.now(ZoneInfo("America/Sao_Paulo")).strftime("%d/%m/%Y %H:%M:%S")
+    _sheet_queue().put([stamp, filename, extracted_text, content_hash])
+    return True, ""
+
+
+@st.cache_resource(show_spinner=False)
+def _sheet_queue() -> queue.Queue:
+    """Fila de linhas do Sheets, drenada por uma thread daemon iniciada uma vez por processo."""
+    rows: queue.Queue = queue.Queue()
+    threading.Thread(target=_sheet_writer, args=(rows,), name="bpmn-sheets", daemon=True).start()
+    return rows
+
+
+def _sheet_writer(rows: queue.Queue) -> None:
+    """Agrupa ate SHEETS_BATCH_SIZE linhas ou SHEETS_FLUSH_SECONDS e grava com um unico append_rows.
+
+    Um lote que falha e tentado de novo uma vez; se falhar outra vez, e registrado no log e descartado,
+    liberando o registro "sheets" desses hashes para que um novo envio grave a linha.
+    """
+    while True:
+        batch = [rows.get()]
+        deadline = time.monotonic() + SHEETS_FLUSH_SECONDS
+        while len(batch) < SHEETS_BATCH_SIZE:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(rows.get(timeout=remaining))
+            except queue.Empty:
+                break
+        ok, err = _flush_sheet_rows(batch)
+        if not ok:
+            logger.warning("Falha ao gravar %d linha(s) no Sheets, nova tentativa: %s", len(batch), err)
+            time.sleep(SHEETS_FLUSH_SECONDS)
+            ok, err = _flush_sheet_rows(batch)
+        if not ok:
+            logger.error("Lote de %d linha(s) descartado apos falha no Sheets: %s", len(batch), err)
+            for row in batch:
+                _release_content(row[3], "sheets")
+
+
+def _flush_sheet_rows(batch: list[list[str]]) -> tuple[bool, str]:
     try:
-        creds = _sheet_credentials()
-        gc = gspread.authorize(creds)
-        sheets_conf = st.secrets["sheets"]
-        ws = gc.open_by_key(sheets_conf["spreadsheet_id"]).worksheet(
-            sheets_conf["worksheet_name"]
-        )
-        stamp = datetime.now(ZoneInfo("America/Sao_Paulo")).strftime("%d/%m/%Y %H:%M:%S")
-        ws.append_row(
-            [stamp, filename, extracted_text],
-            value_input_option="RAW",
+        _with_auth_retry(
+            _get_gspread_worksheet,
+            lambda ws: ws.append_rows(batch, value_input_option="RAW"),
         )
     except Exception as exc:  # pragma: no cover - depende de servico externo
         return False, str(exc)
     return True, ""
 
 
+def _sheets_config_ok() -> bool:
+    return "gcp_service_account" in st.secrets and "sheets" in st.secrets
+
+
 def _drive_config_ok() -> bool:
     return ("gcp_service_account" in st.secrets or "oauth_client" in st.secrets) and "drive" in st.secrets
 
 
 def _sheet_credentials():
+    from google.auth.transport.requests import Request
+    from google.oauth2 import service_account
+    from google.oauth2.credentials import Credentials
+
     scopes = ["https://www.googleapis.com/auth/spreadsheets"]
     if "oauth_client" in st.secrets:
         conf = st.secrets["oauth_client"]
@@ -98,6 +197,9 @@ def _sheet_credentials():
 
 def _drive_credentials():
     """Retorna credenciais do Drive usando OAuth do usuário (preferencial) ou conta de serviço."""
+    from google.oauth2 import service_account
+    from google.oauth2.credentials import Credentials
+
     scopes = ["https://www.googleapis.com/auth/drive.file"]
     if "oauth_client" in st.secrets:
         conf = st.secrets["oauth_client"]
@@ -117,32 +219,111 @@ def _drive_credentials():
     raise ValueError("Nenhuma configuracao de Drive encontrada")
 
 
+@st.cache_resource(show_spinner=False)
+def _get_gspread_worksheet():
+    """Abre (uma vez por processo) a aba configurada do Sheets."""
+    import gspread
+
+    gc = gspread.authorize(_sheet_credentials())
+    sheets_conf = st.secrets["sheets"]
+    return gc.open_by_key(sheets_conf["spreadsheet_id"]).worksheet(
+        sheets_conf["worksheet_name"]
+    )
+
+
+@st.cache_resource(show_spinner=False)
+def _get_drive_credentials():
+    """Credenciais do Drive, criadas uma vez por processo e compartilhadas entre as threads."""
+    return _drive_credentials()
+
+
+@st.cache_resource(show_spinner=False)
+def _drive_services() -> threading.local:
+    """Guarda um cliente do Drive por thread: o transporte httplib2 nao e thread-safe."""
+    return threading.local()
+
+
+def _get_drive_service():
+    """Retorna o cliente do Drive v3 da thread atual, criando-o na primeira chamada."""
+    services = _drive_services()
+    drive = getattr(services, "drive", None)
+    if drive is None:
+        from googleapiclient.discovery import build
+
+        drive = build("drive", "v3", credentials=_get_drive_credentials(), cache_discovery=False)
+        services.drive = drive
+    return drive
+
+
+def _reset_drive_service() -> None:
+    """Descarta as credenciais e o cliente da thread atual (usado apos um 401)."""
+    _get_drive_credentials.clear()
+    _drive_services().__dict__.pop("drive", None)
+
+
+def _is_auth_error(exc: Exception) -> bool:
+    status = getattr(getattr(exc, "resp", None), "status", None)
+    if status is None:
+        status = getattr(getattr(exc, "response", None), "status_code", None)
+    return status == 401
+
+
+def _with_auth_retry(get_client, action, reset=None):
+    """Executa a acao com o cliente cacheado; em 401 recria o cliente e tenta de novo uma vez."""
+    try:
+        return action(get_client())
+    except Exception as exc:
+        if not _is_auth_error(exc):
+            raise
+        (reset or get_client.clear)()
+        return action(get_client())
+
+
+def _create_drive_file(drive, meta: dict, content: bytes):
+    """Cria o arquivo no Drive; acima do limite usa sessao resumable enviada em uma unica requisicao."""
+    from googleapiclient.http import MediaIoBaseUpload
+
+    resumable = len(content) > DRIVE_RESUMABLE_THRESHOLD
+    media = MediaIoBaseUpload(
+        io.BytesIO(content),
+        mimetype="application/octet-stream",
+        chunksize=-1,
+        resumable=resumable,
+    )
+    request = drive.files().create(body=meta, media_body=media, fields="id")
+    if not resumable:
+        return request.execute()
+    response = None
+    while response is None:
+        _status, response = request.next_chunk(num_retries=3)
+    return response
+
+
 def _upload_to_drive(filename: str, content: bytes) -> tuple[bool, str]:
     """Envia o arquivo BPMN para a pasta do Drive configurada em st.secrets."""
     if not _drive_config_ok():
         return False, "Configuracao do Drive ausente."
     try:
-        creds = _drive_credentials()
         drive_conf = st.secrets["drive"]
         folder_id = drive_conf["folder_id"]
-        drive = build("drive", "v3", credentials=creds)
         stamp = datetime.now(ZoneInfo("America/Sao_Paulo")).strftime("%d%m%Y-%H%M%S")
         safe_name = Path(filename).name
         unique_name = f"{stamp}-{safe_name}"
-        media = MediaIoBaseUpload(
-            io.BytesIO(content),
-            mimetype="application/octet-stream",
-            resumable=False,
-        )
         meta = {"name": unique_name, "parents": [folder_id]}
-        drive.files().create(body=meta, media_body=media, fields="id").execute()
+        _with_auth_retry(
+            _get_drive_service,
+            lambda drive: _create_drive_file(drive, meta, content),
+            reset=_reset_drive_service,
+        )
     except Exception as exc:  # pragma: no cover - depende de servico externo
         return False, str(exc)
     return True, ""
 
 
-st.markdown(
-    f"""
+@st.cache_resource(show_spinner=False)
+def _static_html() -> dict[str, str]:
+    """Monta uma vez por processo o HTML fixo da pagina (CSS, cabecalho e card)."""
+    css = f"""
     <style>
     body {{
         background: radial-gradient(circle at 10% 20%, {PALETTE['cyan']}22 0, transparent 25%),
@@ -223,24 +404,6 @@ st.markdown(
         padding: 1rem 1.2rem;
         margin-top: 1rem;
     }}
-    .result-textarea {{
-        width: 100%;
-        min-height: 480px;
-        background: #0a1629;
-        color: #e6edf7;
-        border: 1px solid {PALETTE['blue']}44;
-        border-radius: 12px;
-        padding: 14px 16px;
-        font-family: "Cascadia Mono", "Fira Code", Consolas, "SFMono-Regular", Menlo, monospace;
-        font-size: 15px;
-        line-height: 1.5;
-        white-space: pre;
-        overflow: auto;
-        resize: vertical;
-    }}
-    .result-textarea:focus {{
-        outline: 2px solid {PALETTE['blue']}66;
-    }}
     [data-testid="stCodeBlock"] {{
         background: #0a1629 !important;
         border: 1px solid {PALETTE['blue']}44 !important;
@@ -264,33 +427,15 @@ st.markdown(
     }}
     .social a:hover {{ color: {PALETTE['blue']}; }}
     </style>
-    """,
-    unsafe_allow_html=True,
-)
-
-with st.container():
-    col_logo, col_title, col_social = st.columns([1.2, 3.6, 1], gap="medium")
-    with col_logo:
-        if LOGO_DATA_URI:
-            st.markdown(
-                f"<div class='logo-wrap'><img src='{LOGO_DATA_URI}' class='brand-logo' alt='Logo'></div>",
-                unsafe_allow_html=True,
-            )
-        else:
-            st.image(LOGO_LOCAL, caption="", width=200)
-    with col_title:
-        st.markdown(
-            """
+    """
+    logo = f"<div class='logo-wrap'><img src='{LOGO_URL}' class='brand-logo' alt='Logo'></div>"
+    hero = """
             <div class="hero">
                 <h1>BPMN para Texto</h1>
                 <div class="sub">Envie um BPMN/XML e receba a narrativa estruturada.</div>
             </div>
-            """,
-            unsafe_allow_html=True,
-        )
-    with col_social:
-        st.markdown(
-            f"""
+            """
+    social = f"""
             <div class="social">
                 <div class="social-title">Criador:</div>
                 <a href="https://www.instagram.com/alexandre.processos?igsh=MWMydHZwNjM5c2d3" target="_blank">
@@ -300,22 +445,32 @@ with st.container():
                     <img src="{LI_ICON}" alt="LinkedIn"> LinkedIn
                 </a>
             </div>
-            """,
-            unsafe_allow_html=True,
-        )
-
-with st.container():
-    st.markdown(
-        """
+            """
+    card = """
         <div class="card">
             <strong>Como usar</strong><br>
             1) Arraste um .bpmn ou .xml.<br>
             2) Aguarde o processamento.<br>
             3) Visualize e baixe o texto.
         </div>
-        """,
-        unsafe_allow_html=True,
-    )
+        """
+    return {"css": css, "logo": logo, "hero": hero, "social": social, "card": card}
+
+
+STATIC_HTML = _static_html()
+st.markdown(STATIC_HTML["css"], unsafe_allow_html=True)
+
+with st.container():
+    col_logo, col_title, col_social = st.columns([1.2, 3.6, 1], gap="medium")
+    with col_logo:
+        st.markdown(STATIC_HTML["logo"], unsafe_allow_html=True)
+    with col_title:
+        st.markdown(STATIC_HTML["hero"], unsafe_allow_html=True)
+    with col_social:
+        st.markdown(STATIC_HTML["social"], unsafe_allow_html=True)
+
+with st.container():
+    st.markdown(STATIC_HTML["card"], unsafe_allow_html=True)
 
 uploaded = st.file_uploader("Arquivo BPMN ou XML", type=["bpmn", "xml"])
 result_area = st.empty()
@@ -325,29 +480,40 @@ if uploaded:
     if not data:
         result_area.warning("O arquivo enviado está vazio.")
     else:
-        _upload_to_drive(uploaded.name, data)
-        try:
-            result_text = render_bpmn_bytes(data, filename=uploaded.name)
-        except Exception as exc:
-            result_area.error(f"Erro ao processar o BPMN: {exc}")
-        else:
+        data_hash = hashlib.blake2b(data, digest_size=16).digest()
+        # Reruns do mesmo arquivo (download, copiar) reaproveitam o resultado sem reenviar ao Drive/Sheets
+        if st.session_state.get("last_hash") != data_hash:
+            # Conteudo identico enviado por outra sessao nao e gravado de novo; cada destino tem seu registro
+            if _claim_content(data_hash.hex(), "drive"):
+                _background_executor().submit(_upload_new_content, uploaded.name, data, data_hash.hex())
+            try:
+                result_text = _render_cached(data_hash, data, filename=uploaded.name)
+            except Exception as exc:
+                st.session_state.pop("last_hash", None)
+                result_area.error(f"Erro ao processar o BPMN: {exc}")
+            else:
+                display_text = _display_text(result_text)
+                if _claim_content(data_hash.hex(), "sheets"):
+                    _append_to_sheet(
+                        uploaded.name,
+                        display_text
+                        if len(display_text) <= 48000
+                        else display_text[:48000] + "\n...[truncado para caber no Sheets]",
+                        data_hash.hex(),
+                    )
+                st.session_state["last_hash"] = data_hash
+                st.session_state["result_text"] = result_text
+        if st.session_state.get("last_hash") == data_hash:
+            # So o texto bruto fica na sessao; a versao exibida e derivada a cada rerun
+            result_text = st.session_state["result_text"]
+            display_text = _display_text(result_text)
             with result_area:
                 st.success("Processamento concluído.")
                 default_name = f"{Path(uploaded.name).stem or 'bpmn'}.txt"
-                lines = result_text.splitlines()
-                if lines and lines[0].strip().lower().startswith("titulo:"):
-                    lines.insert(1, "")
-                display_text = "\n".join(lines)
-                sheet_text = display_text
-                if len(sheet_text) > 48000:
-                    sheet_text = sheet_text[:48000] + "\n...[truncado para caber no Sheets]"
-                _append_to_sheet(uploaded.name, sheet_text)
-                download_b64 = base64.b64encode(result_text.encode("utf-8")).decode("ascii")
-                height_px = min(max((len(lines) + 2) * 22, 480), 1400)
-                text_area_id = f"result-text-{uuid4().hex}"
-                copy_btn_id = f"copy-btn-{uuid4().hex}"
-                copy_status_id = f"copy-status-{uuid4().hex}"
-                copy_payload = json.dumps(display_text)
+                dom_key = data_hash.hex()
+                result_key = f"result-text-{dom_key}"
+                copy_btn_id = f"copy-btn-{dom_key}"
+                copy_status_id = f"copy-status-{dom_key}"
                 col1, col2 = st.columns(2)
                 with col1:
                     st.download_button(
@@ -376,8 +542,12 @@ if uploaded:
                     (function() {{
                         const btn = document.getElementById("{copy_btn_id}");
                         const status = document.getElementById("{copy_status_id}");
-                        const textToCopy = {copy_payload};
                         if (!btn) return;
+                        const readText = () => {{
+                            const doc = window.parent ? window.parent.document : document;
+                            const code = doc.querySelector(".st-key-{result_key} code");
+                            return code ? code.textContent : "";
+                        }};
                         const showStatus = (msg, resetMs = 1500) => {{
                             if (!status) return;
                             status.textContent = msg;
@@ -389,6 +559,7 @@ if uploaded:
                             btn.disabled = true;
                             showStatus("Copiando...");
                             try {{
+                                const textToCopy = readText();
                                 if (navigator.clipboard && navigator.clipboard.writeText) {{
                                     await navigator.clipboard.writeText(textToCopy);
                                 }} else {{
@@ -414,12 +585,8 @@ if uploaded:
                     </script>
                     """
                     components.html(actions_html, height=70)
-                st.code(display_text, language="markdown")
-                safe_text = html.escape(display_text)
-                st.markdown(
-                    f"<textarea id='{text_area_id}' class='result-textarea' readonly style='height:{height_px}px'>{safe_text}</textarea>",
-                    unsafe_allow_html=True,
-                )
+                with st.container(key=result_key):
+                    st.code(display_text, language="markdown")
 else:
     result_area.info("Nenhum arquivo enviado ainda. Selecione um .bpmn ou .xml para começar.")
 
@@ -12,9 +12,23 @@ e manter a numeração por caminhos. Uso rápido: python bpmn_to_text.py
 
 
 
+import io
+
+import os
+
 import sys
 
-import xml.etree.ElementTree as ET
+try:
+
+    from lxml import etree as ET
+
+    _HAVE_LXML = True
+
+except ImportError:  # pragma: no cover - fallback sem lxml
+
+    import xml.etree.ElementTree as ET
+
+    _HAVE_LXML = False
 
 from collections import defaultdict
 
@@ -24,6 +38,10 @@ from typing import List, Dict, Tuple
 
 import tempfile
 
+import multiprocessing
+
+from concurrent.futures import ProcessPoolExecutor
+
 
 
 NS = {
@@ -38,6 +56,136 @@ NS = {
 
 
 
+NODE_TAG_MAP = {
+    "task": "Atividade",
+    "userTask": "Atividade (usuário)",
+    "serviceTask": "Atividade (serviço)",
+    "sendTask": "Atividade (envio)",
+    "receiveTask": "Atividade (recebimento)",
+    "manualTask": "Atividade (manual)",
+    "subProcess": "Subprocesso",
+    "callActivity": "Subprocesso (call activity)",
+    "exclusiveGateway": "Gateway exclusivo",
+    "parallelGateway": "Gateway paralelo",
+    "inclusiveGateway": "Gateway inclusivo",
+    "eventBasedGateway": "Gateway baseado em evento",
+    "startEvent": "Evento de início",
+    "endEvent": "Evento de fim",
+    "intermediateThrowEvent": "Evento intermediário",
+    "intermediateCatchEvent": "Evento intermediário",
+    "boundaryEvent": "Evento intermediário (fronteira)",
+}
+
+GATEWAY_KINDS = frozenset(k for k, human in NODE_TAG_MAP.items() if human.startswith("Gateway"))
+
+_SUBPROCESS_KINDS = frozenset({"subProcess", "callActivity"})
+
+# Tipo exibido na linha "Ator: ... | Tipo: ..." das atividades
+_TASK_LABEL = {
+    "task": "Sem tipo",
+    "userTask": "Atividade de Usuário",
+    "serviceTask": "Atividade de Serviço",
+    "sendTask": "Atividade de Envio",
+    "receiveTask": "Atividade de Recebimento",
+    "manualTask": "Atividade Manual",
+}
+
+_TASK_KINDS = frozenset(_TASK_LABEL)
+
+# Colunas de `nodes` (um dict id -> valor por atributo); as quatro ultimas sao
+# classificacoes derivadas do kind, calculadas uma vez em collect_elements
+NODE_COLUMNS = (
+    "type", "name", "kind", "event_flavor", "link_name", "catch_throw",
+    "is_gateway", "is_parallel", "is_event", "task_label",
+)
+
+
+
+
+
+def _xpath(expr: str):
+
+    """Compila a expressão uma vez (lxml); sem lxml, cai no findall do ElementTree."""
+
+    if _HAVE_LXML:
+
+        return ET.XPath(expr, namespaces=NS)
+
+    return lambda elem: elem.findall(expr, NS)
+
+
+
+
+
+def _iterparse(path: Path):
+
+    if _HAVE_LXML:
+
+        return ET.iterparse(
+
+            str(path),
+
+            events=("start", "end"),
+
+            huge_tree=True,
+
+            collect_ids=False,
+
+            resolve_entities=False,
+
+            remove_comments=True,
+
+            remove_pis=True,
+
+        )
+
+    return ET.iterparse(path, events=("start", "end"))
+
+
+
+
+
+def _release(elem):
+
+    """Libera a subárvore já consumida (e, no lxml, os irmãos anteriores)."""
+
+    elem.clear()
+
+    if _HAVE_LXML:
+
+        while elem.getprevious() is not None:
+
+            del elem.getparent()[0]
+
+
+
+
+
+_BPMN = "{" + NS["bpmn"] + "}"
+
+_DI = "{" + NS["di"] + "}"
+
+_DC = "{" + NS["dc"] + "}"
+
+# Tag qualificada -> (kind, rotulo); o kind sai sempre do mesmo objeto str
+_NODE_TAGS = {_BPMN + kind: (kind, human) for kind, human in NODE_TAG_MAP.items()}
+
+_SEQUENCE_FLOW = _BPMN + "sequenceFlow"
+
+_BPMN_LEN = len(_BPMN)
+
+_EVDEF_SUFFIX = "EventDefinition"
+
+
+
+
+
+_XP_PROCESS = _xpath("bpmn:process")
+
+_XP_START_EVENT = _xpath("bpmn:startEvent")
+
+
+
 
 
 def _clean_inline(text: str) -> str:
@@ -51,7 +199,7 @@ def pick_process(defs):
 
     """Escolhe o processo principal: o primeiro que tiver startEvent."""
 
-    processes = defs.findall("bpmn:process", NS)
+    processes = _XP_PROCESS(defs)
 
     if not processes:
 
@@ -59,7 +207,7 @@ def pick_process(defs):
 
     for proc in processes:
 
-        if proc.findall("bpmn:startEvent", NS):
+        if _XP_START_EVENT(proc):
 
             return proc
 
@@ -74,104 +222,107 @@ def pick_process(defs):
 
 
 def collect_elements(proc):
-    """Extrai nós (tarefas, gateways, eventos) e sequenceFlows, marcando links catch/throw."""
-    nodes = {}
-    link_by_name = defaultdict(lambda: {"catch": [], "throw": []})
-
-    tag_map = {
-        "task": "Atividade",
-        "userTask": "Atividade (usuário)",
-        "serviceTask": "Atividade (serviço)",
-        "sendTask": "Atividade (envio)",
-        "receiveTask": "Atividade (recebimento)",
-        "manualTask": "Atividade (manual)",
-        "subProcess": "Subprocesso",
-        "callActivity": "Subprocesso (call activity)",
-        "exclusiveGateway": "Gateway exclusivo",
-        "parallelGateway": "Gateway paralelo",
-        "inclusiveGateway": "Gateway inclusivo",
-        "eventBasedGateway": "Gateway baseado em evento",
-        "startEvent": "Evento de início",
-        "endEvent": "Evento de fim",
-        "intermediateThrowEvent": "Evento intermediário",
-        "intermediateCatchEvent": "Evento intermediário",
-        "boundaryEvent": "Evento intermediário (fronteira)",
-    }
+    """Extrai nós (tarefas, gateways, eventos) e sequenceFlows, marcando links catch/throw.
+
+    `nodes` vem em colunas (ver NODE_COLUMNS): nodes["kind"][node_id], nodes["name"][node_id]...
+    """
+    node_type, node_name, node_kind, node_flavor, node_link, node_catch_throw = {}, {}, {}, {}, {}, {}
+    link_by_name: Dict[str, Tuple[List[str], List[str]]] = {}  # nome -> (catches, throws)
+    flows = {}
+    # Conjuntos ordenados de flow ids (dict com valores None): ordem de inserção e remoção O(1)
+    outgoing = defaultdict(dict)
+    incoming = defaultdict(dict)
+    out_targets = defaultdict(set)  # origem -> alvos dos seus fluxos
+    link_throws = []
+    link_catches = []
 
     def event_flavor(elem):
         for child in elem:
-            tag = child.tag.split('}')[-1]
-            if tag.endswith('EventDefinition'):
-                kind = tag.replace('EventDefinition', '')
-                link_name = child.attrib.get('name', '').strip()
-                return kind, link_name
+            tag = child.tag
+            if not isinstance(tag, str) or not tag.endswith(_EVDEF_SUFFIX):
+                continue  # comentários/PIs (lxml) e demais filhos
+            local = tag[_BPMN_LEN:] if tag.startswith(_BPMN) else tag.rpartition('}')[2]
+            link_name = child.attrib.get('name', '').strip()
+            return local[:-len(_EVDEF_SUFFIX)], link_name
         return '', ''
 
-    for tag_key, human in tag_map.items():
-        for elem in proc.findall(f"bpmn:{tag_key}", NS):
-            detail, link_name = event_flavor(elem) if 'Event' in tag_key else ('', '')
-            nodes[elem.attrib['id']] = {
-                'type': human,
-                'name': elem.attrib.get('name', ''),
-                'kind': tag_key,
-                'event_flavor': detail,
-                'link_name': link_name,
-                'catch_throw': '',
+    # Uma única passada pelos filhos do processo: nós e sequenceFlows
+    for elem in proc:
+        tag = elem.tag
+        if tag == _SEQUENCE_FLOW:
+            flow_id = elem.attrib['id']
+            flows[flow_id] = {
+                'name': elem.attrib.get('name', '').strip(),
+                'source': elem.attrib.get('sourceRef'),
+                'target': elem.attrib.get('targetRef'),
             }
-            if tag_key == 'intermediateCatchEvent' and link_name:
-                link_by_name[link_name]['catch'].append(elem.attrib['id'])
-            if tag_key == 'intermediateThrowEvent' and link_name:
-                link_by_name[link_name]['throw'].append(elem.attrib['id'])
+            outgoing[flows[flow_id]['source']][flow_id] = None
+            incoming[flows[flow_id]['target']][flow_id] = None
+            out_targets[flows[flow_id]['source']].add(flows[flow_id]['target'])
+            continue
+        known = _NODE_TAGS.get(tag)
+        if known is None:
+            continue  # outros elementos, comentários/PIs (lxml)
+        tag_key, human = known
+        nid = elem.attrib['id']
+        detail, link_name = event_flavor(elem) if 'Event' in tag_key else ('', '')
+        node_type[nid] = human
+        node_name[nid] = elem.attrib.get('name', '')
+        node_kind[nid] = tag_key
+        node_flavor[nid] = detail
+        node_link[nid] = link_name
+        node_catch_throw[nid] = ''
+        if tag_key == 'intermediateCatchEvent' and link_name:
+            link_catches.append((link_name, nid))
+        if tag_key == 'intermediateThrowEvent' and link_name:
+            link_throws.append((link_name, nid))
+
+    # Disparos antes das capturas, mantendo a ordem dos grupos de link
+    for link_name, tid in link_throws:
+        link_by_name.setdefault(link_name, ([], []))[1].append(tid)
+    for link_name, cid in link_catches:
+        link_by_name.setdefault(link_name, ([], []))[0].append(cid)
 
     # Marca captura/disparo só se houver ambos com o mesmo nome
-    for nm, group in link_by_name.items():
-        if group['catch'] and group['throw']:
-            for cid in group['catch']:
-                if cid in nodes:
-                    nodes[cid]['catch_throw'] = 'captura'
-            for tid in group['throw']:
-                if tid in nodes:
-                    nodes[tid]['catch_throw'] = 'disparo'
-
-    flows = {}
-    outgoing = defaultdict(list)
-    incoming = defaultdict(list)
-
-    for sf in proc.findall('bpmn:sequenceFlow', NS):
-        flow_id = sf.attrib['id']
-        flows[flow_id] = {
-            'name': sf.attrib.get('name', '').strip(),
-            'source': sf.attrib.get('sourceRef'),
-            'target': sf.attrib.get('targetRef'),
-        }
-        outgoing[flows[flow_id]['source']].append(flow_id)
-        incoming[flows[flow_id]['target']].append(flow_id)
+    for nm, (catches, throws) in link_by_name.items():
+        if catches and throws:
+            for cid in catches:
+                if cid in node_catch_throw:
+                    node_catch_throw[cid] = 'captura'
+            for tid in throws:
+                if tid in node_catch_throw:
+                    node_catch_throw[tid] = 'disparo'
 
     # Se um catch de link não tem incoming e há throw correspondente, insere o catch no caminho do seu target
-    for nm, group in link_by_name.items():
-        if not (group['catch'] and group['throw']):
+    for nm, (catches, throws) in link_by_name.items():
+        if not (catches and throws):
             continue
-        for cid in group['catch']:
+        for cid in catches:
             if incoming.get(cid):
                 continue
-            outs = outgoing.get(cid, [])
+            outs = outgoing.get(cid)
             # Se o catch tem outgoing (caso raro), apenas garante que incoming vazio não bloqueie
             if outs:
                 continue
             # pega o primeiro flow do target original conectado ao throw correspondente
-            for tid in group['throw']:
+            for tid in throws:
                 if not outgoing.get(tid):
                     continue
                 # usa o primeiro fluxo do throw
-                first_out = outgoing[tid][0]
+                first_out = next(iter(outgoing[tid]))
                 tgt = flows[first_out]['target']
-                # redireciona incoming do target para o catch
-                for inc_id in list(incoming.get(tgt, [])):
-                    flows[inc_id]['target'] = cid
-                    incoming[cid].append(inc_id)
-                    incoming[tgt].remove(inc_id)
+                # redireciona todo o incoming do target para o catch
+                moved = incoming.get(tgt)
+                if moved:
+                    for inc_id in moved:
+                        flows[inc_id]['target'] = cid
+                        src_targets = out_targets[flows[inc_id]['source']]
+                        src_targets.discard(tgt)
+                        src_targets.add(cid)
+                    incoming[cid].update(moved)
+                    incoming[tgt] = {}
                 # cria fluxo catch -> target se não existir
-                if not any(flows[f]['target'] == tgt for f in outgoing.get(cid, [])):
+                if tgt not in out_targets[cid]:
                     flow_id = f"_linkcatch_{cid}_{tgt}"
                     flows[flow_id] = {
                         'name': f"Link: {nm}" if nm else 'Link',
@@ -179,18 +330,19 @@ def collect_elements(proc):
                         'target': tgt,
                         'is_link': True,
                     }
-                    outgoing[cid].append(flow_id)
-                    incoming[tgt].append(flow_id)
+                    outgoing[cid][flow_id] = None
+                    incoming[tgt][flow_id] = None
+                    out_targets[cid].add(tgt)
                 break
 
     # Se um throw de link não tem saída, cria fluxo sintético para o catch correspondente
-    for nm, group in link_by_name.items():
-        if not (group['catch'] and group['throw']):
+    for nm, (catches, throws) in link_by_name.items():
+        if not (catches and throws):
             continue
-        for tid in group['throw']:
+        for tid in throws:
             if outgoing.get(tid):
                 continue
-            for cid in group['catch']:
+            for cid in catches:
                 flow_id = f"_link_{tid}_{cid}"
                 flows[flow_id] = {
                     'name': f"Link: {nm}" if nm else 'Link',
@@ -198,60 +350,293 @@ def collect_elements(proc):
                     'target': cid,
                     'is_link': True,
                 }
-                outgoing[tid].append(flow_id)
-                incoming[cid].append(flow_id)
-
+                outgoing[tid][flow_id] = None
+                incoming[cid][flow_id] = None
+                out_targets[tid].add(cid)
+
+    is_gateway = {nid: kind in GATEWAY_KINDS for nid, kind in node_kind.items()}
+    is_parallel = {nid: kind == 'parallelGateway' for nid, kind in node_kind.items()}
+    is_event = {nid: 'Event' in kind for nid, kind in node_kind.items()}
+    task_label = {nid: _TASK_LABEL.get(kind) for nid, kind in node_kind.items()}
+    nodes = dict(zip(NODE_COLUMNS, (
+        node_type, node_name, node_kind, node_flavor, node_link, node_catch_throw,
+        is_gateway, is_parallel, is_event, task_label,
+    )))
     return nodes, flows, outgoing, incoming
 
-def collect_lanes(proc):
+def collect_di_bounds(shapes, node_ids, lane_ids):
 
-    """Mapeia nós para lanes (por flowNodeRef) e retorna nomes das lanes."""
+    """Separa os Bounds dos BPMNShape em nós e lanes (para inferir ator via DI)."""
 
-    node_lane = {}
+    node_bounds = {}
 
-    lane_name = {}
+    lane_bounds = {}
 
-    for lane in proc.findall(".//bpmn:lane", NS):
+    for elem_id, rect in shapes.items():
 
-        lid = lane.attrib.get("id")
+        if elem_id in node_ids:
 
-        lname = _clean_inline(lane.attrib.get("name", "") or "(sem ator)")
+            node_bounds[elem_id] = rect
 
-        if lid:
+        if elem_id in lane_ids:
 
-            lane_name[lid] = lname
+            lane_bounds[elem_id] = rect
 
-        for ref in lane.findall("bpmn:flowNodeRef", NS):
+    return node_bounds, lane_bounds
 
-            if ref.text:
 
-                node_lane[ref.text.strip()] = lname
 
-    return node_lane, lane_name
 
 
+def collect_artifacts(doc, node_ids: set) -> Tuple[Dict[str, List[str]], Dict[str, List[str]], Dict[str, List[str]], List[str]]:
 
+    """Associa nós a documentos, sistemas e anotações, separando anotações órfãs.
 
+    Retorna (docs_by_node, systems_by_node, notes_by_node, orphan_notes), já no formato
+    de saída: documentos e sistemas ordenados sem repetição, anotações sem repetição na
+    ordem em que aparecem.
+    """
 
-def collect_di_bounds(defs, node_ids, lane_ids):
+    annotations = doc["annotations"]
 
-    """Coleta Bounds dos BPMNShape para nós e lanes (para inferir ator via DI)."""
+    data_object_defs = dict(doc["data_objects"])
 
-    node_bounds = {}
+    data_store_defs = dict(doc["data_stores"])
 
-    lane_bounds = {}
 
-    for shape in defs.findall(".//di:BPMNShape", NS):
 
-        elem_id = shape.attrib.get("bpmnElement")
+    data_objects = {}
+
+    for dobj_id, ref, name in doc["data_object_refs"]:
+
+        if not name and ref in data_object_defs:
 
-        bounds = shape.find("dc:Bounds", NS)
+            name = data_object_defs.get(ref, "")
+
+        name = name or dobj_id
+
+        data_objects[dobj_id] = ("Documento", name)
+
+    for dobj_id, name in doc["data_objects"]:
+
+        data_objects[dobj_id] = ("Documento", name or dobj_id)
+
+
+
+    data_stores = {}
+
+    for dstore_id, ref, name in doc["data_store_refs"]:
+
+        if not name and ref in data_store_defs:
+
+            name = data_store_defs.get(ref, "")
+
+        name = name or dstore_id
+
+        data_stores[dstore_id] = ("Sistema", name)
+
+
+
+    artifacts = {**annotations, **data_objects, **data_stores}
+
+    by_label = {"Documento": defaultdict(list), "Sistema": defaultdict(list), "Anotação": defaultdict(list)}
+
+    attached_notes = set()
+
+
+
+    def attach(src, tgt):
+
+        if src in artifacts and tgt in node_ids:
+
+            label, text = artifacts[src]
+
+            by_label[label][tgt].append(text)
+
+            if label == "Anotação":
+
+                attached_notes.add(src)
+
+        if tgt in artifacts and src in node_ids:
+
+            label, text = artifacts[tgt]
+
+            by_label[label][src].append(text)
+
+            if label == "Anotação":
+
+                attached_notes.add(tgt)
+
+
+
+    for assoc_kind in ("associations", "input_associations", "output_associations"):
+
+        for srcs, tgt in doc[assoc_kind]:
+
+            for src in srcs:
+
+                attach(src, tgt)
+
+
+
+    docs_by_node = {nid: sorted({_clean_inline(text) for text in texts}) for nid, texts in by_label["Documento"].items()}
+
+    systems_by_node = {nid: sorted({_clean_inline(text) for text in texts}) for nid, texts in by_label["Sistema"].items()}
+
+    notes_by_node = {
+
+        nid: list(dict.fromkeys(key for key in map(_clean_note, texts) if key))
+
+        for nid, texts in by_label["Anotação"].items()
+
+    }
+
+    orphan_notes = [artifacts[nid][1] for nid in annotations.keys() if nid not in attached_notes]
+
+
+
+    return docs_by_node, systems_by_node, notes_by_node, orphan_notes
+
+
+
+
+
+def _new_lane_scan():
+
+    """Estado das lanes do processo em leitura (preenchido pelos eventos de lane/flowNodeRef)."""
+
+    return {"node_lane": {}, "lane_name": {}, "rank": {}, "count": 0, "open": []}
+
+
+
+
+
+def _scan_lane_start(elem, stack, doc):
+
+    lanes = doc["lane_scan"]
+
+    lanes["count"] += 1
+
+    lid = elem.attrib.get("id")
+
+    lname = _clean_inline(elem.attrib.get("name", "") or "(sem ator)")
+
+    if lid:
+
+        lanes["lane_name"][lid] = lname
+
+    lanes["open"].append((lanes["count"], lname))
+
+
+
+
+
+def _scan_lane(elem, stack, doc):
+
+    doc["lane_scan"]["open"].pop()
+
+    elem.clear()  # nome e refs já registrados
+
+
+
+
+
+def _scan_flow_node_ref(elem, stack, doc):
+
+    lanes = doc["lane_scan"]
+
+    if not elem.text or not lanes["open"] or stack[-1] != _BPMN + "lane":
+
+        return
+
+    rank, lname = lanes["open"][-1]
+
+    ref = elem.text.strip()
+
+    # Vale a última lane em pré-ordem (a mais interna), como na busca .//lane
+    if rank >= lanes["rank"].get(ref, 0):
+
+        lanes["node_lane"][ref] = lname
+
+        lanes["rank"][ref] = rank
+
+
+
+
+
+def _scan_process(elem, stack, doc):
+
+    if len(stack) != 1:
+
+        return  # apenas processos filhos diretos de definitions
+
+    lanes = doc["lane_scan"]
+
+    doc["lane_scan"] = _new_lane_scan()
+
+    node_lane, lane_name = lanes["node_lane"], lanes["lane_name"]
+
+    doc["processes"].append(
+
+        {
+
+            "attrib": dict(elem.attrib),
+
+            "elements": collect_elements(elem),
+
+            "lanes": (node_lane, lane_name),
+
+            "start_events": [e.attrib["id"] for e in _XP_START_EVENT(elem)],
+
+        }
+
+    )
+
+    _release(elem)
+
+
+
+
+
+def _scan_collaboration(elem, stack, doc):
+
+    if len(stack) == 1:
+
+        _release(elem)
+
+
+
+
+
+def _scan_participant(elem, stack, doc):
+
+    if len(stack) == 2 and stack[-1] == _BPMN + "collaboration":
+
+        doc["participants"].append((elem.attrib.get("processRef"), elem.attrib.get("id"), elem.attrib.get("name", "")))
+
+
+
+
+
+def _scan_message_flow(elem, stack, doc):
+
+    if len(stack) == 2 and stack[-1] == _BPMN + "collaboration":
+
+        doc["message_flows"].append(dict(elem.attrib))
 
-        if not elem_id or bounds is None:
 
-            continue
 
-        rect = (
+
+
+def _scan_shape(elem, stack, doc):
+
+    elem_id = elem.attrib.get("bpmnElement")
+
+    bounds = next((child for child in elem if child.tag == _DC + "Bounds"), None)
+
+    if elem_id and bounds is not None:
+
+        doc["shapes"][elem_id] = (
 
             float(bounds.attrib.get("x", 0)),
 
@@ -263,203 +648,210 @@ def collect_di_bounds(defs, node_ids, lane_ids):
 
         )
 
-        if elem_id in node_ids:
+    elem.clear()
 
-            node_bounds[elem_id] = rect
 
-        if elem_id in lane_ids:
 
-            lane_bounds[elem_id] = rect
 
-    return node_bounds, lane_bounds
 
+def _scan_text_annotation(elem, stack, doc):
 
+    text_el = next((child for child in elem if child.tag == _BPMN + "text"), None)
 
+    if text_el is not None:
 
+        text_val = _clean_note(text_el.text or "")
 
-def collect_artifacts(defs, node_ids: set) -> Dict[str, List[Tuple[str, str]]]:
+        if text_val:
 
-    """Associa nós a documentos, sistemas e anotações, separando anotações órfãs."""
+            doc["annotations"][elem.attrib.get("id")] = ("Anotação", text_val)
 
-    annotations = {}
 
-    for ta in defs.findall(".//bpmn:textAnnotation", NS):
 
-        text_el = ta.find("bpmn:text", NS)
 
-        if text_el is not None:
 
-            text_val = _clean_note(text_el.text or "")
+def _scan_data_object(elem, stack, doc):
 
-            if text_val:
+    doc["data_objects"].append((elem.attrib.get("id"), _clean_inline(elem.attrib.get("name", "") or "")))
 
-                annotations[ta.attrib.get("id")] = ("Anotação", text_val)
 
 
 
-    data_object_defs = {}
 
-    for dobj in defs.findall(".//bpmn:dataObject", NS):
+def _scan_data_store(elem, stack, doc):
 
-        name = _clean_inline(dobj.attrib.get("name", "") or "")
+    doc["data_stores"].append((elem.attrib.get("id"), _clean_inline(elem.attrib.get("name", "") or "")))
 
-        data_object_defs[dobj.attrib.get("id")] = name
 
 
 
-    data_store_defs = {}
 
-    for ds in defs.findall(".//bpmn:dataStore", NS):
+def _scan_data_object_ref(elem, stack, doc):
 
-        name = _clean_inline(ds.attrib.get("name", "") or "")
+    doc["data_object_refs"].append(
 
-        data_store_defs[ds.attrib.get("id")] = name
+        (elem.attrib.get("id"), elem.attrib.get("dataObjectRef"), _clean_inline(elem.attrib.get("name", "") or ""))
 
+    )
 
 
-    data_objects = {}
 
-    for dobj in defs.findall(".//bpmn:dataObjectReference", NS):
 
-        ref = dobj.attrib.get("dataObjectRef")
 
-        name = _clean_inline(dobj.attrib.get("name", "") or "")
+def _scan_data_store_ref(elem, stack, doc):
 
-        if not name and ref in data_object_defs:
+    doc["data_store_refs"].append(
 
-            name = data_object_defs.get(ref, "")
+        (elem.attrib.get("id"), elem.attrib.get("dataStoreRef"), (elem.attrib.get("name") or "").strip())
 
-        name = name or dobj.attrib.get("id")
+    )
 
-        data_objects[dobj.attrib.get("id")] = ("Documento", name)
 
-    for dobj in defs.findall(".//bpmn:dataObject", NS):
 
-        name = _clean_inline(dobj.attrib.get("name", "") or "")
 
-        name = name or dobj.attrib.get("id")
 
-        data_objects[dobj.attrib.get("id")] = ("Documento", name)
+def _scan_association(elem, stack, doc):
 
+    doc["associations"].append(([elem.attrib.get("sourceRef")], elem.attrib.get("targetRef")))
 
 
-    data_stores = {}
 
-    for dstore in defs.findall(".//bpmn:dataStoreReference", NS):
 
-        ref = dstore.attrib.get("dataStoreRef")
 
-        name = (dstore.attrib.get("name") or "").strip()
+def _data_association(elem):
 
-        if not name and ref in data_store_defs:
+    srcs = [el.text for el in elem if el.tag == _BPMN + "sourceRef" and el.text]
 
-            name = data_store_defs.get(ref, "")
+    tgt_el = next((el for el in elem if el.tag == _BPMN + "targetRef"), None)
 
-        name = name or dstore.attrib.get("id")
+    return srcs, (tgt_el.text or "") if tgt_el is not None else ""
 
-        data_stores[dstore.attrib.get("id")] = ("Sistema", name)
 
 
 
-    artifacts = {**annotations, **data_objects, **data_stores}
 
-    by_node: Dict[str, List[Tuple[str, str]]] = defaultdict(list)
+def _scan_data_input_association(elem, stack, doc):
 
-    attached_notes = set()
+    doc["input_associations"].append(_data_association(elem))
 
 
 
-    def attach(src, tgt):
 
-        if src in artifacts and tgt in node_ids:
 
-            by_node[tgt].append(artifacts[src])
+def _scan_data_output_association(elem, stack, doc):
 
-            if artifacts[src][0] == "Anotação":
+    doc["output_associations"].append(_data_association(elem))
 
-                attached_notes.add(src)
 
-        if tgt in artifacts and src in node_ids:
 
-            by_node[src].append(artifacts[tgt])
 
-            if artifacts[tgt][0] == "Anotação":
 
-                attached_notes.add(tgt)
+_SCAN_HANDLERS = {
+
+    _BPMN + "process": _scan_process,
+
+    _BPMN + "collaboration": _scan_collaboration,
 
+    _BPMN + "participant": _scan_participant,
 
+    _BPMN + "messageFlow": _scan_message_flow,
 
-    for assoc in defs.findall(".//bpmn:association", NS):
+    _DI + "BPMNShape": _scan_shape,
 
-        src = assoc.attrib.get("sourceRef")
+    _BPMN + "textAnnotation": _scan_text_annotation,
 
-        tgt = assoc.attrib.get("targetRef")
+    _BPMN + "dataObject": _scan_data_object,
 
-        attach(src, tgt)
+    _BPMN + "dataStore": _scan_data_store,
 
+    _BPMN + "dataObjectReference": _scan_data_object_ref,
 
+    _BPMN + "dataStoreReference": _scan_data_store_ref,
 
-    for dia in defs.findall(".//bpmn:dataInputAssociation", NS):
+    _BPMN + "association": _scan_association,
 
-        srcs = [el.text for el in dia.findall("bpmn:sourceRef", NS) if el.text]
+    _BPMN + "dataInputAssociation": _scan_data_input_association,
 
-        tgt = dia.findtext("bpmn:targetRef", default="", namespaces=NS)
+    _BPMN + "dataOutputAssociation": _scan_data_output_association,
 
-        for src in srcs:
+    _BPMN + "lane": _scan_lane,
 
-            attach(src, tgt)
+    _BPMN + "flowNodeRef": _scan_flow_node_ref,
+
+}
 
 
 
-    for doa in defs.findall(".//bpmn:dataOutputAssociation", NS):
+# Despachados no evento "start" (o atributo já está completo; os filhos ainda não)
+_SCAN_START_HANDLERS = {
 
-        srcs = [el.text for el in doa.findall("bpmn:sourceRef", NS) if el.text]
+    _BPMN + "lane": _scan_lane_start,
 
-        tgt = doa.findtext("bpmn:targetRef", default="", namespaces=NS)
+}
 
-        for src in srcs:
 
-            attach(src, tgt)
 
 
 
-    orphan_notes = [artifacts[nid] for nid in annotations.keys() if nid not in attached_notes]
+def scan_definitions(path: Path) -> dict:
 
-    if orphan_notes:
+    """Lê o BPMN numa única passada (iterparse), despachando cada elemento pelo tag qualificado."""
 
-        by_node["_orphan_annotations_"] = orphan_notes
+    doc = {
 
+        "processes": [],
 
+        "participants": [],
 
-    return by_node
+        "message_flows": [],
 
+        "shapes": {},
 
+        "annotations": {},
 
+        "data_objects": [],
 
+        "data_stores": [],
 
-def rect_contains(rect, point):
+        "data_object_refs": [],
 
-    x, y, w, h = rect
+        "data_store_refs": [],
 
-    px, py = point
+        "associations": [],
 
-    return x <= px <= x + w and y <= py <= y + h
+        "input_associations": [],
 
+        "output_associations": [],
 
+        "lane_scan": _new_lane_scan(),
 
+    }
 
+    stack = []
 
-def rect_intersection_area(a, b):
+    for event, elem in _iterparse(path):
 
-    ax, ay, aw, ah = a
+        if event == "start":
 
-    bx, by, bw, bh = b
+            handler = _SCAN_START_HANDLERS.get(elem.tag)
 
-    x_overlap = max(0, min(ax + aw, bx + bw) - max(ax, bx))
+            if handler is not None:
 
-    y_overlap = max(0, min(ay + ah, by + bh) - max(ay, by))
+                handler(elem, stack, doc)
+
+            stack.append(elem.tag)
+
+            continue
 
-    return x_overlap * y_overlap
+        stack.pop()
+
+        handler = _SCAN_HANDLERS.get(elem.tag)
+
+        if handler is not None:
+
+            handler(elem, stack, doc)
+
+    return doc
 
 
 
@@ -471,61 +863,63 @@ def infer_lane_by_di(nodes, node_lane, lane_name, node_bounds, lane_bounds):
 
     result = dict(node_lane)
 
-    for node_id, rect in node_bounds.items():
+    # Bordas e area de cada lane calculadas uma vez, na ordem de lane_bounds
+    lanes = [(lane_id, lx, ly, lx + lw, ly + lh, lw * lh) for lane_id, (lx, ly, lw, lh) in lane_bounds.items()]
+
+    for node_id, (x, y, w, h) in node_bounds.items():
 
         if node_id in result:
 
             continue  # ja mapeado por flowNodeRef
 
-        overlaps = []
-
-        for lane_id, lrect in lane_bounds.items():
+        x2, y2 = x + w, y + h
 
-            inter = rect_intersection_area(rect, lrect)
+        # maior interseccao, depois menor area da lane (a primeira em caso de empate)
+        chosen, best_inter, best_area, ties = None, 0, 0, 0
 
-            if inter > 0:
+        for lane_id, lx, ly, lx2, ly2, area in lanes:
 
-                overlaps.append((inter, lrect[2] * lrect[3], lane_id))
+            x_overlap = min(x2, lx2) - max(x, lx)
 
-        if overlaps:
+            y_overlap = min(y2, ly2) - max(y, ly)
 
-            overlaps.sort(key=lambda t: (-t[0], t[1]))  # maior interseccao, depois menor area da lane
+            if x_overlap <= 0 or y_overlap <= 0:
 
-            top = [o for o in overlaps if o[0] == overlaps[0][0]]
+                continue
 
-            chosen = top[0][2]
+            inter = x_overlap * y_overlap
 
-            name = lane_name.get(chosen, "(ator nao identificado)")
+            if inter > best_inter:
 
-            if len(top) > 1:
+                chosen, best_inter, best_area, ties = lane_id, inter, area, 1
 
-                name = f"{name} (ambiguo)"
+            elif inter == best_inter and inter > 0:
 
-            result[node_id] = name
+                ties += 1
 
-            continue
+                if area < best_area:
 
-        cx, cy = rect[0] + rect[2] / 2, rect[1] + rect[3] / 2
+                    chosen, best_area = lane_id, area
 
-        candidates = []
+        if chosen is None:
 
-        for lane_id, lrect in lane_bounds.items():
+            cx, cy = x + w / 2, y + h / 2
 
-            if rect_contains(lrect, (cx, cy)):
+            for lane_id, lx, ly, lx2, ly2, area in lanes:
 
-                area = lrect[2] * lrect[3]
+                if lx <= cx <= lx2 and ly <= cy <= ly2:
 
-                candidates.append((area, lane_id))
+                    ties += 1  # menor area contendo o centro
 
-        if candidates:
+                    if chosen is None or area < best_area:
 
-            candidates.sort(key=lambda t: t[0])  # menor area contendo
+                        chosen, best_area = lane_id, area
 
-            chosen = candidates[0][1]
+        if chosen is not None:
 
             name = lane_name.get(chosen, "(ator nao identificado)")
 
-            if len(candidates) > 1:
+            if ties > 1:
 
                 name = f"{name} (ambiguo)"
 
@@ -545,72 +939,43 @@ def format_number(parts):
 
 
 
-def compare_parts(a, b):
-
-    """Compara listas numéricas lexicograficamente."""
-
-    for xa, xb in zip(a, b):
-
-        if xa < xb:
-
-            return -1
-
-        if xa > xb:
-
-            return 1
-
-    if len(a) == len(b):
-
-        return 0
+def describe_node(nodes, node_id):
 
-    return -1 if len(a) < len(b) else 1
+    kind = nodes["kind"][node_id]
 
+    node_type = nodes["type"][node_id]
 
+    name = _clean_inline(nodes["name"][node_id] or "")
 
-
-
-def describe_node(node):
-
-    name = _clean_inline(node.get("name") or "")
-
-    task_kinds = {
-        "task",
-        "userTask",
-        "serviceTask",
-        "sendTask",
-        "receiveTask",
-        "manualTask",
-    }
-
-    if node.get("kind") in task_kinds:
+    if kind in _TASK_KINDS:
 
         display = name or "(sem nome)"
 
         return f"Atividade: {display}"
 
-    is_gateway = node["type"].startswith("Gateway")
+    is_gateway = nodes["is_gateway"][node_id]
 
-    is_event = "Event" in node.get("kind", "")
+    is_event = nodes["is_event"][node_id]
 
     catch_throw = None
 
-    if node.get("kind") == "intermediateCatchEvent":
+    if kind == "intermediateCatchEvent":
 
         catch_throw = "captura"
 
-    elif node.get("kind") == "intermediateThrowEvent":
+    elif kind == "intermediateThrowEvent":
 
         catch_throw = "disparo"
 
     if is_gateway and not name:
 
-        return node["type"]
+        return node_type
 
     display = name or "(sem nome)"
 
     if is_event:
 
-        flavor = node.get("event_flavor") or ""
+        flavor = nodes["event_flavor"][node_id] or ""
 
         if flavor == "link" and catch_throw:
 
@@ -620,11 +985,11 @@ def describe_node(node):
 
             parts = [p for p in (flavor, catch_throw) if p]
 
-            type_label = f"{node['type']} ({', '.join(parts)})" if parts else node["type"]
+            type_label = f"{node_type} ({', '.join(parts)})" if parts else node_type
 
         return f"{type_label}: {display}"
 
-    return f"{node['type']}: {display}"
+    return f"{node_type}: {display}"
 
 
 
@@ -640,512 +1005,592 @@ def _clean_note(text: str) -> str:
 
 
 
-def walk(node_id, numbering, nodes, flows, outgoing, incoming, node_lane, path_set, number_map, branch_state, artifacts):
+class _IndentCache(dict):
 
-    """DFS com numeração hierárquica; evita duplicar nós já descritos e corta loops no mesmo caminho."""
+    """Recuo por nível ("    " * nível), montado uma vez por nível."""
 
-    lines = []
+    def __missing__(self, level):
 
-    node = nodes.get(node_id, {"type": "Elemento", "name": node_id})
+        value = self[level] = "    " * level
 
-    if node["type"] == "Elemento":
+        return value
 
-        return lines, numbering  # ignora nós desconhecidos
 
-    indent = "    " * (len(numbering) - 1)
 
-    detail_indent = indent + "    "
 
-    num_str = format_number(numbering)
 
+_INDENT = _IndentCache()
 
 
-    if node_id in number_map:
 
-        prev = number_map[node_id]
 
-        cmp = compare_parts(prev["parts"], numbering)
 
-        if cmp < 0:
+# Operações da pilha explícita de walk
 
-            label = "retorna para"
+_VISIT, _BRANCH, _BRANCH_DONE, _LEAVE = range(4)
 
-        elif cmp > 0:
 
-            label = "avança para"
 
-        else:
 
-            label = "referência"
 
-        lines.append(f"{indent}({label} {prev['num_str']})")
+def walk(node_id, numbering, nodes, flows, flow_target, outs_of, in_count, node_lane, depth_map, number_map, branch_state, artifacts, buf):
 
-        return lines, numbering
+    """DFS com numeração hierárquica; evita duplicar nós já descritos e corta loops no mesmo caminho.
 
+    outs_of (id -> flow ids de saída), in_count (id -> nº de entradas) e flow_target (flow id -> alvo) vêm de _render_pool.
+    """
 
+    write = buf.write
 
-    if node_id in path_set:
+    node_kind = nodes["kind"]
 
-        lines.append(f"{indent}(loop em {num_str})")
+    node_is_gateway = nodes["is_gateway"]
 
-        return lines, numbering
+    node_is_parallel = nodes["is_parallel"]
 
+    node_task_label = nodes["task_label"]
 
+    docs_by_node, systems_by_node, notes_by_node = artifacts
 
-    outs = outgoing.get(node_id, [])
+    numbering = list(numbering)
 
-    is_gateway = node["type"].startswith("Gateway")
+    stack = [(_VISIT, node_id, False)]
 
-    is_diverging_gateway = is_gateway and len(outs) > 1
 
-    is_converging_gateway = is_gateway and len(incoming.get(node_id, [])) > 1 and len(outs) == 1 and not is_diverging_gateway
 
-    is_parallel_convergence = is_converging_gateway and node.get("kind") == "parallelGateway"
+    while stack:
 
+        item = stack.pop()
 
+        op = item[0]
 
-    # Se for gateway apenas de convergência (exceto paralelos), não imprime linha; passa adiante
 
-    if is_converging_gateway and outs and not is_parallel_convergence:
 
-        number_map[node_id] = {"num_str": num_str, "parts": numbering}
+        if op == _LEAVE:
 
-        new_path = path_set | {node_id}
+            del depth_map[item[1]]
 
-        next_id = flows[outs[0]]["target"]
+            continue
 
-        child_lines, last_num = walk(
 
-            next_id,
 
-            numbering,
+        if op == _BRANCH_DONE:
 
-            nodes,
+            _op, state, parent_len = item
 
-            flows,
+            # numbering ainda é a da última visita do ramo
 
-            outgoing,
+            if len(numbering) > parent_len:
 
-            incoming,
+                suffix = numbering[parent_len]
 
-            node_lane,
+                state["next"] = max(state["next"], suffix + 1)
+
+            continue
 
-            new_path,
 
-            number_map,
 
-            branch_state,
+        if op == _BRANCH:
 
-            artifacts,
+            _op, is_parallel, outs, branch_idx, parent_len, state = item
 
-        )
+            child_num = state["next"]
 
-        lines.extend(child_lines)
+            state["next"] += 1
 
-        return lines, last_num
+            flow_id = outs[branch_idx - 1]
 
+            flow = flows[flow_id]
 
+            child = flow_target[flow_id]
 
-    prefix = f"{indent}{num_str}. "
+            if not flow["name"] and is_parallel:
 
-    desc = describe_node(node)
+                branch = f"Caminho {branch_idx:02d}"
 
-    detail_indent = indent + "    "
+            else:
+
+                branch = _clean_inline(flow["name"]) or f"Caminho {child_num}"
 
-    if is_parallel_convergence:
+            write(f"{_INDENT[parent_len]}Caso {branch}:\n")
 
-        desc = "Fim do Gateway Paralelo (convergência)"
+            if branch_idx < len(outs):
 
-    lines.append(f"{prefix}{desc}")
+                stack.append((_BRANCH, is_parallel, outs, branch_idx + 1, parent_len, state))
 
-    task_kinds = {
+            stack.append((_BRANCH_DONE, state, parent_len))
 
-        "task": "Sem tipo",
+            del numbering[parent_len:]
 
-        "userTask": "Atividade de Usuário",
+            numbering.append(child_num)
 
-        "serviceTask": "Atividade de Serviço",
+            numbering.append(1)
 
-        "sendTask": "Atividade de Envio",
+            stack.append((_VISIT, child, False))
 
-        "receiveTask": "Atividade de Recebimento",
+            continue
 
-        "manualTask": "Atividade Manual",
 
-    }
 
-    if node.get("kind") in task_kinds:
+        _op, node_id, advance = item
 
-        actor = _clean_inline(node_lane.get(node_id, "(ator nao identificado)"))
+        if advance:
 
-        type_label = task_kinds[node["kind"]]
+            numbering[-1] += 1
 
-        lines.append(f"{detail_indent}Ator: {actor} | Tipo: {type_label}")
 
-    elif node.get("kind") in {"subProcess", "callActivity"}:
 
-        actor = _clean_inline(node_lane.get(node_id, "(ator nao identificado)"))
+        is_gateway = node_is_gateway.get(node_id)
 
-        lines.append(f"{detail_indent}Ator: {actor}")
+        if is_gateway is None:
 
+            continue  # ignora nós desconhecidos
 
+        is_parallel = node_is_parallel[node_id]
 
-    docs = sorted({_clean_inline(text) for label, text in artifacts.get(node_id, []) if label == "Documento"})
+        level = len(numbering) - 1
 
-    systems = sorted({_clean_inline(text) for label, text in artifacts.get(node_id, []) if label == "Sistema"})
+        indent = _INDENT[level]
 
-    notes = []
+        num_str = format_number(numbering)
 
-    seen_notes = set()
 
-    for label, text in artifacts.get(node_id, []):
 
-        if label == "Anotação":
+        if node_id in number_map:
 
-            key = _clean_note(text)
+            prev = number_map[node_id]
 
-            if key and key not in seen_notes:
+            current = tuple(numbering)
 
-                seen_notes.add(key)
+            if prev["parts"] < current:
 
-                notes.append(key)
+                label = "retorna para"
 
-    if docs or systems:
+            elif prev["parts"] > current:
 
-        info_indent = indent + "    "
+                label = "avança para"
 
-        parts = []
+            else:
 
-        if systems:
+                label = "referência"
 
-            parts.append(f"Sistema: {', '.join(systems)}")
+            write(f"{indent}({label} {prev['num_str']})\n")
 
-        if docs:
+            continue
 
-            parts.append(f"Documento: {', '.join(docs)}")
 
-        lines.append(f"{info_indent}{' | '.join(parts)}")
 
-    if notes:
+        if node_id in depth_map:
 
-        info_indent = indent + "    "
+            write(f"{indent}(loop em {num_str})\n")
 
-        for text in notes:
-            lines.append(f'{info_indent}Anotação: "{text}"')
+            continue
 
 
 
-    number_map[node_id] = {"num_str": num_str, "parts": numbering}
+        outs = outs_of.get(node_id, ())
 
-    new_path = path_set | {node_id}
+        is_diverging_gateway = is_gateway and len(outs) > 1
 
+        is_converging_gateway = is_gateway and in_count.get(node_id, 0) > 1 and len(outs) == 1 and not is_diverging_gateway
 
+        is_parallel_convergence = is_converging_gateway and is_parallel
 
-    last_used = numbering
 
 
+        # Se for gateway apenas de convergência (exceto paralelos), não imprime linha; passa adiante
 
-    if is_diverging_gateway:
+        if is_converging_gateway and outs and not is_parallel_convergence:
 
-        state = branch_state.setdefault(node_id, {"next": 1})
+            number_map[node_id] = {"num_str": num_str, "parts": tuple(numbering)}
 
-        for branch_idx, flow_id in enumerate(outs, start=1):
+            depth_map[node_id] = level
 
-            child_num = state["next"]
+            stack.append((_LEAVE, node_id))
 
-            state["next"] += 1
+            stack.append((_VISIT, flow_target[outs[0]], False))
 
-            flow = flows[flow_id]
+            continue
 
-            child = flow["target"]
 
-            if not flow["name"] and node.get("kind") == "parallelGateway":
 
-                branch = f"Caminho {branch_idx:02d}"
+        desc = describe_node(nodes, node_id)
 
-            else:
+        detail_indent = _INDENT[level + 1]
 
-                branch = _clean_inline(flow["name"]) or f"Caminho {child_num}"
+        if is_parallel_convergence:
 
-            branch_indent = indent + "    "
+            desc = "Fim do Gateway Paralelo (convergência)"
 
-            lines.append(f"{branch_indent}Caso {branch}:")
+        write(f"{indent}{num_str}. {desc}\n")
 
-            child_lines, last_num = walk(
+        type_label = node_task_label[node_id]
 
-                child,
+        if type_label is not None:
 
-                numbering + [child_num, 1],
+            actor = _clean_inline(node_lane.get(node_id, "(ator nao identificado)"))
 
-                nodes,
+            write(f"{detail_indent}Ator: {actor} | Tipo: {type_label}\n")
 
-                flows,
+        elif node_kind[node_id] in _SUBPROCESS_KINDS:
 
-                outgoing,
+            actor = _clean_inline(node_lane.get(node_id, "(ator nao identificado)"))
 
-                incoming,
+            write(f"{detail_indent}Ator: {actor}\n")
 
-                node_lane,
 
-                new_path,
 
-                number_map,
+        docs = docs_by_node.get(node_id, ())
 
-                branch_state,
+        systems = systems_by_node.get(node_id, ())
 
-                artifacts,
+        notes = notes_by_node.get(node_id, ())
 
-            )
+        if docs or systems:
 
-            lines.extend(child_lines)
+            parts = []
 
-            last_used = last_num
+            if systems:
 
-            if len(last_num) > len(numbering):
+                parts.append(f"Sistema: {', '.join(systems)}")
 
-                suffix = last_num[len(numbering)]
+            if docs:
 
-                state["next"] = max(state["next"], suffix + 1)
+                parts.append(f"Documento: {', '.join(docs)}")
+
+            write(f"{detail_indent}{' | '.join(parts)}\n")
+
+        if notes:
+
+            for text in notes:
+
+                write(f'{detail_indent}Anotação: "{text}"\n')
+
+
+
+        number_map[node_id] = {"num_str": num_str, "parts": tuple(numbering)}
+
+        depth_map[node_id] = level
+
+        stack.append((_LEAVE, node_id))
+
+
+
+        if is_diverging_gateway:
+
+            state = branch_state.setdefault(node_id, {"next": 1})
+
+            stack.append((_BRANCH, is_parallel, outs, 1, len(numbering), state))
+
+        elif len(outs) == 1:
+
+            next_id = flow_target[outs[0]]
+
+            stack.append((_VISIT, next_id, True))
+
+
+
+    return numbering
+
+
+
+# Abaixo disso, criar processos custa mais que renderizar os pools em sequência
+_PARALLEL_MIN_NODES = 5000
+
+
+
+
+
+def _usable_cpus() -> int:
+
+    """CPUs que este processo pode usar (respeita afinidade/cgroups onde o SO informa)."""
+
+    try:
+
+        return len(os.sched_getaffinity(0))
+
+    except AttributeError:  # pragma: no cover - sem sched_getaffinity (macOS/Windows)
+
+        return os.cpu_count() or 1
+
+
+
+
+
+def _render_pool(job) -> str:
+
+    """Renderiza um pool (título e um walk por startEvent); roda também em processo separado."""
+
+    title, start_events, nodes, flows, outgoing, incoming, node_lane_map, lane_name, node_bounds, lane_bounds, artifacts = job
 
-    elif len(outs) == 1:
+    node_lane = infer_lane_by_di(nodes, node_lane_map, lane_name, node_bounds, lane_bounds)
 
-        next_id = flows[outs[0]]["target"]
+    outs_of = {nid: tuple(fids) for nid, fids in outgoing.items()}
 
-        next_number = numbering[:-1] + [numbering[-1] + 1]
+    in_count = {nid: len(fids) for nid, fids in incoming.items()}
 
-        child_lines, last_num = walk(
+    flow_target = {fid: flow["target"] for fid, flow in flows.items()}
 
-            next_id,
+    buf = io.StringIO()
 
-            next_number,
+    buf.write(f"Titulo: {title}\n")
+
+    for idx, start_id in enumerate(start_events, start=1):
+
+        walk(
+
+            start_id,
+
+            [idx],
 
             nodes,
 
             flows,
 
-            outgoing,
+            flow_target,
 
-            incoming,
+            outs_of,
+
+            in_count,
 
             node_lane,
 
-            new_path,
+            {},
 
-            number_map,
+            {},
 
-            branch_state,
+            {},
 
             artifacts,
 
+            buf,
+
         )
 
-        lines.extend(child_lines)
+    buf.write("\n")  # separador entre pools
 
-        last_used = last_num
+    return buf.getvalue()
 
 
 
-    return lines, last_used
 
 
+class _TrimmedWriter:
 
+    """Repassa o texto para out segurando o espaço em branco final (equivale a .rstrip() no fim)."""
 
+    def __init__(self, out):
 
-def render_bpmn(path: Path) -> str:
+        self.out = out
 
-    tree = ET.parse(path)
+        self.pending = ""
 
-    defs = tree.getroot()
+    def write(self, text):
 
-    processes = defs.findall("bpmn:process", NS)
+        body = text.rstrip()
 
-    if not processes:
+        if body:
 
-        raise ValueError("Nenhum processo encontrado no BPMN.")
+            self.out.write(self.pending + body if self.pending else body)
 
+            self.pending = text[len(body):]
 
+        else:
 
-    participant_by_proc: Dict[str, str] = {}
+            self.pending += text
 
-    participant_by_id: Dict[str, str] = {}
 
-    orphan_annotations: List[Tuple[str, str]] = []
 
-    proc_info = []
 
-    all_node_ids = set()
 
-    for collab in defs.findall("bpmn:collaboration", NS):
+def render_bpmn(path: Path, out=None, parallel: bool = False):
 
-        for part in collab.findall("bpmn:participant", NS):
+    """Renderiza o BPMN. Com out (arquivo de texto), escreve nele à medida que gera e retorna
+    None; sem out, retorna o texto. Em ambos os casos sem espaço em branco no final.
 
-            pref = part.attrib.get("processRef")
+    parallel=True permite renderizar pools grandes em processos separados (usado pela CLI);
+    o padrão é em sequência, já que o app roda dentro de um servidor com várias threads.
+    """
 
-            pid = part.attrib.get("id")
+    if out is None:
 
-            if pref:
+        buf = io.StringIO()
 
-                participant_by_proc[pref] = part.attrib.get("name", "").strip()
+        render_bpmn(path, buf, parallel=parallel)
 
-            if pid:
+        return buf.getvalue()
 
-                participant_by_id[pid] = part.attrib.get("name", "").strip() or participant_by_proc.get(pref, "")
+    doc = scan_definitions(path)
 
+    if not doc["processes"]:
 
+        raise ValueError("Nenhum processo encontrado no BPMN.")
 
-    for proc in processes:
 
-        nodes, flows, outgoing, incoming = collect_elements(proc)
 
-        proc_info.append((proc, nodes, flows, outgoing, incoming))
+    participant_by_proc: Dict[str, str] = {}
 
-        all_node_ids.update(nodes.keys())
+    participant_by_id: Dict[str, str] = {}
 
+    orphan_annotations: List[str] = []
 
+    proc_info = []
 
-    artifacts_global = collect_artifacts(defs, all_node_ids)
+    all_node_ids = set()
 
-    orphan_annotations = artifacts_global.pop("_orphan_annotations_", [])
+    for pref, pid, pname in doc["participants"]:
 
+        if pref:
 
+            participant_by_proc[pref] = pname.strip()
 
-    node_to_pool: Dict[str, str] = {}
+        if pid:
 
-    node_meta: Dict[str, Tuple[str, Dict[str, str]]] = {}
+            participant_by_id[pid] = pname.strip() or participant_by_proc.get(pref, "")
 
-    all_lines = []
 
-    msg_lines: List[str] = []
 
-    for proc, nodes, flows, outgoing, incoming in proc_info:
+    for proc in doc["processes"]:
 
-        for nid in nodes.keys():
+        nodes, flows, outgoing, incoming = proc["elements"]
 
-            node_to_pool[nid] = proc.attrib.get("id", "")
+        proc_info.append((proc, nodes, flows, outgoing, incoming))
 
-            node_meta[nid] = ("", nodes[nid])
+        all_node_ids.update(nodes["kind"])
 
-        node_lane_map, lane_name = collect_lanes(proc)
 
-        node_bounds, lane_bounds = collect_di_bounds(defs, set(nodes.keys()), set(lane_name.keys()))
 
-        node_lane = infer_lane_by_di(nodes, node_lane_map, lane_name, node_bounds, lane_bounds)
+    docs_by_node, systems_by_node, notes_by_node, orphan_annotations = collect_artifacts(doc, all_node_ids)
 
-        artifacts = artifacts_global
+    artifacts_global = (docs_by_node, systems_by_node, notes_by_node)
 
 
 
-        start_events = [e.attrib["id"] for e in proc.findall("bpmn:startEvent", NS)]
+    node_to_pool: Dict[str, str] = {}
 
-        if not start_events:
+    node_meta: Dict[str, Tuple[str, str]] = {}
 
-            continue
+    write = _TrimmedWriter(out).write
 
+    msg_lines: List[str] = []
 
+    pool_jobs = []
 
-        title = proc.attrib.get("name") or participant_by_proc.get(proc.attrib.get("id"), "") or path.stem
+    pool_nodes = 0
 
-        for nid in nodes.keys():
+    for proc, nodes, flows, outgoing, incoming in proc_info:
 
-            node_meta[nid] = (title, nodes[nid])
+        node_name, node_type = nodes["name"], nodes["type"]
 
-        lines = [f"Titulo: {title}"]
+        for nid in node_type:
 
-        for idx, start_id in enumerate(start_events, start=1):
+            node_to_pool[nid] = proc["attrib"].get("id", "")
 
-            branch_lines, _last = walk(
+            node_meta[nid] = ("", node_name[nid] or node_type[nid])
 
-                start_id,
+        start_events = proc["start_events"]
 
-                [idx],
+        if not start_events:
 
-                nodes,
+            continue
 
-                flows,
 
-                outgoing,
 
-                incoming,
+        node_lane_map, lane_name = proc["lanes"]
 
-                node_lane,
+        node_bounds, lane_bounds = collect_di_bounds(doc["shapes"], set(node_type), set(lane_name.keys()))
 
-                set(),
+        title = proc["attrib"].get("name") or participant_by_proc.get(proc["attrib"].get("id"), "") or path.stem
 
-                {},
+        for nid in node_type:
 
-                {},
+            node_meta[nid] = (title, node_name[nid] or node_type[nid])
 
-                artifacts,
+        pool_jobs.append(
 
-            )
+            (title, start_events, nodes, flows, outgoing, incoming, node_lane_map, lane_name, node_bounds, lane_bounds, artifacts_global)
 
-            lines.extend(branch_lines)
+        )
 
-        all_lines.extend(lines)
+        pool_nodes += len(node_type)
 
-        all_lines.append("")  # separador entre pools
 
 
+    # Pools são independentes: com vários pools grandes e mais de uma CPU, cada um vai para um processo
+    workers = min(len(pool_jobs), _usable_cpus()) if parallel and pool_nodes >= _PARALLEL_MIN_NODES else 1
 
-    for collab in defs.findall("bpmn:collaboration", NS):
+    if workers > 1:
 
-        for mf in collab.findall("bpmn:messageFlow", NS):
+        # spawn: não herda threads/estado do processo pai via fork
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as executor:
 
-            src = mf.attrib.get("sourceRef")
+            pool_texts = executor.map(_render_pool, pool_jobs)
 
-            tgt = mf.attrib.get("targetRef")
+            for text in pool_texts:
 
-            if not src or not tgt:
+                write(text)
 
-                continue
+    else:
 
-            src_proc = node_to_pool.get(src, "")
+        for job in pool_jobs:
 
-            tgt_proc = node_to_pool.get(tgt, "")
+            write(_render_pool(job))
 
-            src_pool_name = participant_by_id.get(src) or participant_by_proc.get(src_proc, src_proc or "")
 
-            tgt_pool_name = participant_by_id.get(tgt) or participant_by_proc.get(tgt_proc, tgt_proc or "")
 
-            if src in node_meta:
+    for mf in doc["message_flows"]:
 
-                pool_title, meta = node_meta[src]
+        src = mf.get("sourceRef")
 
-                src_pool_name = src_pool_name or pool_title
+        tgt = mf.get("targetRef")
 
-                src_elem = meta.get("name") or meta.get("type")
+        if not src or not tgt:
 
-            else:
+            continue
 
-                src_elem = src
+        src_proc = node_to_pool.get(src, "")
 
-            if tgt in node_meta:
+        tgt_proc = node_to_pool.get(tgt, "")
 
-                pool_title, meta = node_meta[tgt]
+        src_pool_name = participant_by_id.get(src) or participant_by_proc.get(src_proc, src_proc or "")
 
-                tgt_pool_name = tgt_pool_name or pool_title
+        tgt_pool_name = participant_by_id.get(tgt) or participant_by_proc.get(tgt_proc, tgt_proc or "")
 
-                tgt_elem = meta.get("name") or meta.get("type")
+        if src in node_meta:
 
-            else:
+            pool_title, src_elem = node_meta[src]
+
+            src_pool_name = src_pool_name or pool_title
+
+        else:
+
+            src_elem = src
+
+        if tgt in node_meta:
+
+            pool_title, tgt_elem = node_meta[tgt]
+
+            tgt_pool_name = tgt_pool_name or pool_title
+
+        else:
 
-                tgt_elem = tgt
+            tgt_elem = tgt
 
-            src_label = f"{src_pool_name or src_proc}:{src_elem}"
+        src_label = f"{src_pool_name or src_proc}:{src_elem}"
 
-            tgt_label = f"{tgt_pool_name or tgt_proc}:{tgt_elem}"
+        tgt_label = f"{tgt_pool_name or tgt_proc}:{tgt_elem}"
 
-            mf_name = mf.attrib.get("name", "").strip() or "(sem nome)"
+        mf_name = mf.get("name", "").strip() or "(sem nome)"
 
-            msg_lines.append((src_pool_name, src_elem, tgt_pool_name, tgt_elem, mf_name))
+        msg_lines.append((src_pool_name, src_elem, tgt_pool_name, tgt_elem, mf_name))
 
 
 
     if msg_lines:
 
-        all_lines.append("Interações entre processos (message flows):")
+        write("Interações entre processos (message flows):\n")
 
-        all_lines.append("- Origem (Processo / Elemento) | Destino (Processo / Elemento) | Mensagem")
+        write("- Origem (Processo / Elemento) | Destino (Processo / Elemento) | Mensagem\n")
 
         for src_pool_name, src_elem, tgt_pool_name, tgt_elem, mf_name in msg_lines:
 
@@ -1153,19 +1598,19 @@ def render_bpmn(path: Path) -> str:
 
             tgt_desc = f"{tgt_pool_name} / {tgt_elem}"
 
-            all_lines.append(f"- {src_desc} | {tgt_desc} | {mf_name}")
+            write(f"- {src_desc} | {tgt_desc} | {mf_name}\n")
 
 
 
     if orphan_annotations:
 
-        all_lines.append("")
+        write("\n")
 
-        all_lines.append("Anotações não ligadas a elementos:")
+        write("Anotações não ligadas a elementos:\n")
 
         seen = set()
 
-        for _label, text in orphan_annotations:
+        for text in orphan_annotations:
 
             key = _clean_note(text)
 
@@ -1173,11 +1618,7 @@ def render_bpmn(path: Path) -> str:
 
                 seen.add(key)
 
-                all_lines.append(f'- "{key}"')
-
-
-
-    return "\n".join(all_lines).rstrip()
+                write(f'- "{key}"\n')
 
 
 
@@ -1233,7 +1674,9 @@ def main():
 
         raise SystemExit(f"Arquivo BPMN nao encontrado: {bpmn_path}")
 
-    print(render_bpmn(bpmn_path))
+    render_bpmn(bpmn_path, out=sys.stdout, parallel=True)
+
+    sys.stdout.write("\n")
 
 
 
@@ -1261,7 +1704,11 @@ def render_bpmn_bytes(content: bytes, filename: str = "arquivo") -> str:
 
     try:
 
-        return render_bpmn(tmp_path)
+        buf = io.StringIO()
+
+        render_bpmn(tmp_path, out=buf)
+
+        return buf.getvalue()
 
     finally:
 
@@ -0,0 +1,30 @@
+"""
+Build opcional do bpmn_to_text com Cython (modo Python puro, sem .pyx).
+
+    BPMN_ENABLE_SPEEDUPS=1 python setup.py build_ext --inplace
+
+Gera uma extensão compilada ao lado de bpmn_to_text.py, que passa a ter
+prioridade no import. Sem a variável nada é compilado (Cython não é exigido) e o
+módulo Python puro continua sendo usado.
+"""
+
+import os
+
+from setuptools import setup
+
+ext_modules = []
+
+if os.environ.get("BPMN_ENABLE_SPEEDUPS"):
+
+    from Cython.Build import cythonize
+
+    ext_modules = cythonize(
+        ["bpmn_to_text.py"],
+        compiler_directives={"language_level": 3, "boundscheck": False, "annotation_typing": False},
+    )
+
+setup(
+    name="bpmn-to-text",
+    py_modules=["bpmn_to_text"],
+    ext_modules=ext_modules,
+)